@@ -1,34 +1,137 @@
 import os
+import sys
+import asyncio
 import time
+import datetime as dt
+import functools
+import orjson
 import requests
-from typing import Dict, Any, Optional
+from requests.adapters import HTTPAdapter
+import urllib3
+from urllib3.util.retry import Retry
+from typing import Dict, Any, Optional, Tuple
 from fastmcp import FastMCP
 from dotenv import load_dotenv
 
 load_dotenv()
 
-mcp = FastMCP(name="The Trench MCP Server")
-
 # Configuration
 TRENCH_API_URL = os.getenv("TRENCH_API_URL", "http://localhost:8000")
 TRENCH_API_KEY = os.getenv("TRENCH_API_KEY", "")
 
-def make_api_request(method: str, endpoint: str, data: Optional[Dict] = None) -> Dict[str, Any]:
-    """Make authenticated request to Trench API"""
-    url = f"{TRENCH_API_URL.rstrip('/')}/api{endpoint}"
-    headers = {
-        "Authorization": f"Bearer {TRENCH_API_KEY}",
-        "Content-Type": "application/json"
-    }
+_BASE_URL = TRENCH_API_URL.rstrip('/') + '/api'
+
+# Shared session so every tool call reuses pooled keep-alive connections
+_SESSION = requests.Session()
+_SESSION.headers.update({
+    "Authorization": f"Bearer {TRENCH_API_KEY}",
+    "Content-Type": "application/json"
+})
+# Retry transient failures on GETs only; POSTs are never replayed so a downlink can't start twice
+_retry = Retry(
+    total=3,
+    connect=3,
+    read=2,
+    status=2,
+    backoff_factor=0.2,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset(["GET"]),
+)
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=_retry)
+_SESSION.mount("http://", _adapter)
+_SESSION.mount("https://", _adapter)
+
+# Seconds to cache successful GET responses per endpoint. Only the pass schedule, which is static per
+# scenario, is cached: TTLs are wall-clock while anything tied to sim time (/time, /passes/next) moves at clock_speed.
+_GET_CACHE_TTLS: Dict[str, float] = {
+    "/passes/all": 60.0,
+}
+_GET_CACHE: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+_METHODS = {
+    "GET": _SESSION.get,
+    "POST": _SESSION.post,
+    "PUT": _SESSION.put,
+    "DELETE": _SESSION.delete,
+}
+
+@functools.lru_cache(maxsize=1024)
+def _parse_iso(value: str) -> dt.datetime:
+    """Parse an ISO timestamp (trailing 'Z' allowed) into a UTC-aware datetime"""
+    parsed = dt.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=dt.timezone.utc)
+    return parsed.astimezone(dt.timezone.utc)
+
+# Output templates, filled by _fmt with the API result over these defaults
+_TIME_TEMPLATE = """Current Time Information:
+- UTC Time: {current_time}
+- ISO Time: {current_time_iso}
+- Epoch Start: {epoch_utc}
+- Clock Speed: {clock_speed}x real-time
+"""
+_TIME_DEFAULTS: Dict[str, Any] = {
+    "current_time": "Unknown",
+    "current_time_iso": "Unknown",
+    "epoch_utc": "Unknown",
+    "clock_speed": 1,
+}
+
+_PASS_ENTRY_TEMPLATE = """Pass {index}:
+  - AOS: {aos_utc}
+  - LOS: {los_utc}
+  - Duration: {duration_s:.0f}s
+  - Max Elevation: {max_elev_deg}°
+  - Satellite: {sat_id}
+  - Ground Station: {gs_id}"""
+_NEXT_PASS_TEMPLATE = """Next Pass:
+- AOS: {aos_utc}
+- LOS: {los_utc}
+- Duration: {duration_s:.0f} seconds
+- Max Elevation: {max_elev_deg}°
+- Satellite: {sat_id}
+- Ground Station: {gs_id}
+"""
+_PASS_DEFAULTS: Dict[str, Any] = {
+    "aos_utc": "Unknown",
+    "los_utc": "Unknown",
+    "duration_s": 0,
+    "max_elev_deg": 0,
+    "sat_id": "Unknown",
+    "gs_id": "Unknown",
+}
+
+_DOWNLINK_STOP_TEMPLATE = """Downlink stopped: {message}
+
+Final Downlink Status:
+- Total Data Downloaded: {kb_downloaded_total:.1f} KB
+- Final Bitrate: {current_bitrate_kbps} kbps
+- Was In Pass: {was_in_pass}"""
+_DOWNLINK_STATUS_DEFAULTS: Dict[str, Any] = {
+    "kb_downloaded_total": 0,
+    "current_bitrate_kbps": 0,
+}
+
+def _fmt(template: str, result: Dict[str, Any], defaults: Dict[str, Any], **extra: Any) -> str:
+    """Fill a str.format template from an API result, using defaults for missing fields"""
+    return template.format_map({**defaults, **result, **extra})
+
+def _send_request(method: str, endpoint: str, data: Optional[Dict] = None) -> Dict[str, Any]:
+    """Make authenticated request to Trench API, blocking the calling thread"""
+    url = _BASE_URL + endpoint
+    verb = method.upper()
+    send = _METHODS.get(verb)
+    if send is None:
+        return {"error": f"Unsupported HTTP method: {method}"}
+    
+    ttl = _GET_CACHE_TTLS.get(endpoint, 0) if verb == "GET" else 0
+    if ttl:
+        cached_at, cached = _GET_CACHE.get(endpoint, (0.0, None))
+        if cached is not None and time.monotonic() - cached_at < ttl:
+            return cached
     
     try:
-        if method.upper() == "GET":
-            response = requests.get(url, headers=headers, timeout=10)
-        elif method.upper() == "POST":
-            response = requests.post(url, headers=headers, json=data, timeout=10)
-        else:
-            return {"error": f"Unsupported HTTP method: {method}"}
-        
+        response = send(url, json=data, timeout=10)
         response.raise_for_status()
         
         # Check if response has content before trying to parse JSON
@@ -36,56 +139,58 @@ def make_api_request(method: str, endpoint: str, data: Optional[Dict] = None) ->
             return {"error": f"Empty response from API endpoint {endpoint}"}
         
         try:
-            return response.json()
-        except ValueError as json_error:
+            result = orjson.loads(response.content)
+        except orjson.JSONDecodeError as json_error:
             return {"error": f"Invalid JSON response from {endpoint}: {str(json_error)}. Response content: {response.text[:200]}"}
+        
+        if ttl:
+            _GET_CACHE[endpoint] = (time.monotonic(), result)
+        return result
             
     except requests.exceptions.RequestException as e:
         return {"error": f"API request failed for {url}: {str(e)}"}
 
+async def make_api_request(method: str, endpoint: str, data: Optional[Dict] = None) -> Dict[str, Any]:
+    """Make authenticated request to Trench API without blocking the event loop"""
+    return await asyncio.to_thread(_send_request, method, endpoint, data)
+
+mcp = FastMCP(name="The Trench MCP Server")
+
 # === SIMULATION STATE TOOLS ===
 
 @mcp.tool()
-def test_api_connection() -> str:
+async def test_api_connection() -> str:
     """
     Test the connection to the Trench API server.
     Useful for debugging connectivity issues.
     """
-    try:
-        # Try a simple GET request to the time endpoint
-        result = make_api_request("GET", "/time")
-        if "error" in result:
-            return f"Connection test failed: {result['error']}\n\nAPI URL: {TRENCH_API_URL}\nAPI Key configured: {'Yes' if TRENCH_API_KEY else 'No'}"
-        else:
-            return f"Connection test successful!\n\nAPI URL: {TRENCH_API_URL}\nCurrent simulation time: {result.get('sim_time_s', 'unknown')}s\nClock speed: {result.get('clock_speed', 'unknown')}x"
-    except Exception as e:
-        return f"Connection test failed with exception: {str(e)}\n\nAPI URL: {TRENCH_API_URL}"
+    # Try a simple GET request to the time endpoint; failures come back as an error dict
+    result = await make_api_request("GET", "/time")
+    if "error" in result:
+        return f"Connection test failed: {result['error']}\n\nAPI URL: {TRENCH_API_URL}\nAPI Key configured: {'Yes' if TRENCH_API_KEY else 'No'}"
+    else:
+        return f"Connection test successful!\n\nAPI URL: {TRENCH_API_URL}\nCurrent simulation time: {result.get('sim_time_s', 'unknown')}s\nClock speed: {result.get('clock_speed', 'unknown')}x"
 
 @mcp.tool()
-def get_current_time() -> str:
+async def get_current_time() -> str:
     """
     Get the current simulation time and real-world UTC time.
     """
-    result = make_api_request("GET", "/time")
+    result = await make_api_request("GET", "/time")
     if "error" in result:
         return f"Error: {result['error']}"
     
-    return f"""Current Time Information:
-- UTC Time: {result.get('current_time', 'Unknown')}
-- ISO Time: {result.get('current_time_iso', 'Unknown')}
-- Epoch Start: {result.get('epoch_utc', 'Unknown')}
-- Clock Speed: {result.get('clock_speed', 1)}x real-time
-"""
+    return _fmt(_TIME_TEMPLATE, result, _TIME_DEFAULTS)
 
 # === PASS MANAGEMENT TOOLS ===
 
 @mcp.tool()
-def get_all_passes() -> str:
+async def get_all_passes() -> str:
     """
     Get information about all passes defined in the scenario.
     Shows complete schedule of satellite passes over the ground station.
     """
-    result = make_api_request("GET", "/passes/all")
+    result = await make_api_request("GET", "/passes/all")
     if "error" in result:
         return f"Error: {result['error']}"
     
@@ -95,103 +200,79 @@ def get_all_passes() -> str:
     if not passes:
         return "No passes defined in scenario"
     
-    output = f"All Passes ({total} total):\n"
+    parts = [f"All Passes ({total} total):\n"]
     for i, p in enumerate(passes, 1):
-        output += f"\nPass {i}:"
-        output += f"\n  - AOS: {p.get('aos_utc', 'Unknown')}"
-        output += f"\n  - LOS: {p.get('los_utc', 'Unknown')}"
-        output += f"\n  - Duration: {p.get('duration_s', 0):.0f}s"
-        output += f"\n  - Max Elevation: {p.get('max_elev_deg', 0)}°"
-        output += f"\n  - Satellite: {p.get('sat_id', 'Unknown')}"
-        output += f"\n  - Ground Station: {p.get('gs_id', 'Unknown')}"
+        parts.append(_fmt(_PASS_ENTRY_TEMPLATE, p, _PASS_DEFAULTS, index=i))
     
-    return output
+    return "\n".join(parts)
 
 @mcp.tool()
-def get_next_pass() -> str:
+async def get_next_pass() -> str:
     """
     Get information about the next upcoming satellite pass.
     Returns None if no future passes are scheduled.
     """
-    result = make_api_request("GET", "/passes/next")
+    result = await make_api_request("GET", "/passes/next")
     if "error" in result:
         return f"Error: {result['error']}"
     
     if result.get('pass') is None:
         return result.get('message', 'No upcoming passes')
     
-    p = result.get('pass')
-    return f"""Next Pass:
-- AOS: {p.get('aos_utc', 'Unknown')}
-- LOS: {p.get('los_utc', 'Unknown')}
-- Duration: {p.get('duration_s', 0):.0f} seconds
-- Max Elevation: {p.get('max_elev_deg', 0)}°
-- Satellite: {p.get('sat_id', 'Unknown')}
-- Ground Station: {p.get('gs_id', 'Unknown')}
-"""
+    return _fmt(_NEXT_PASS_TEMPLATE, result['pass'], _PASS_DEFAULTS)
 
 # === TIMING AND WAITING TOOLS ===
 
 @mcp.tool()
-def wait_until_time(target_time_iso: str) -> str:
+async def wait_until_time(target_time_iso: str) -> str:
     """
     Wait until the simulation reaches a specific UTC time.
-    Polls the simulation every 0.1 seconds until the target time is reached.
+    Polls the simulation with an adaptive interval that shrinks as the target approaches.
     
     Args:
         target_time_iso: Target UTC time in ISO format (e.g., "2025-09-15T17:30:00Z")
     """
-    import datetime as dt
-    
     try:
-        # Parse the target ISO time
-        if target_time_iso.endswith('Z'):
-            target_time_iso = target_time_iso[:-1] + '+00:00'
-        target_dt = dt.datetime.fromisoformat(target_time_iso)
-        
-        # Convert to UTC if not already
-        if target_dt.tzinfo is None:
-            target_dt = target_dt.replace(tzinfo=dt.timezone.utc)
-        else:
-            target_dt = target_dt.astimezone(dt.timezone.utc)
-            
+        target_dt = _parse_iso(target_time_iso)
     except ValueError as e:
         return f"Error parsing target time '{target_time_iso}': {str(e)}"
     
+    target_ts = target_dt.timestamp()
+    
     start_time = time.time()
     max_wait_seconds = 86400  # 1 day timeout
     
     while time.time() - start_time < max_wait_seconds:
-        result = make_api_request("GET", "/time")
+        result = await make_api_request("GET", "/time")
         if "error" in result:
             return f"Error checking time: {result['error']}"
         
-        current_time_iso = result.get('current_time_iso')
-        if not current_time_iso:
-            return "Error: No current_time_iso in API response"
-        
-        try:
-            # Parse current simulation time
-            if current_time_iso.endswith('Z'):
-                current_time_iso_fixed = current_time_iso[:-1] + '+00:00'
-            else:
-                current_time_iso_fixed = current_time_iso
-            current_dt = dt.datetime.fromisoformat(current_time_iso_fixed)
-            
-            # Convert to UTC if not already
-            if current_dt.tzinfo is None:
-                current_dt = current_dt.replace(tzinfo=dt.timezone.utc)
-            else:
-                current_dt = current_dt.astimezone(dt.timezone.utc)
+        # Prefer epoch + sim seconds (the epoch parse is memoized); fall back to the ISO timestamp
+        epoch_utc = result.get('epoch_utc')
+        sim_time_s = result.get('sim_time_s')
+        if epoch_utc and isinstance(sim_time_s, (int, float)):
+            try:
+                current_ts = _parse_iso(epoch_utc).timestamp() + sim_time_s
+            except ValueError as e:
+                return f"Error parsing epoch time '{epoch_utc}': {str(e)}"
+        else:
+            current_time_iso = result.get('current_time_iso')
+            if not current_time_iso:
+                return "Error: No current_time_iso in API response"
             
-            # Check if we've reached the target time
-            if current_dt >= target_dt:
-                return f"Time has been reached"
-                
-        except ValueError as e:
-            return f"Error parsing current time '{current_time_iso}': {str(e)}"
+            try:
+                current_ts = _parse_iso(current_time_iso).timestamp()
+            except ValueError as e:
+                return f"Error parsing current time '{current_time_iso}': {str(e)}"
+        
+        # Check if we've reached the target time
+        if current_ts >= target_ts:
+            return "Time has been reached"
         
-        time.sleep(0.1)  # Wait 0.1 seconds before checking again
+        # Sleep for half of the remaining wall-clock time (sim time scaled by clock speed)
+        clock_speed = result.get('clock_speed') or 1
+        remaining = (target_ts - current_ts) / clock_speed
+        await asyncio.sleep(max(0.05, min(remaining * 0.5, 5.0)))
     
     return f"Timeout waiting for UTC time {target_dt.isoformat()}Z"
 
@@ -199,12 +280,12 @@ def wait_until_time(target_time_iso: str) -> str:
 # === DOWNLINK CONTROL TOOLS ===
 
 @mcp.tool()
-def start_downlink_simple() -> str:
+async def start_downlink_simple() -> str:
     """
     Start a data downlink session with default parameters (no arguments required).
     Must be called during an active satellite pass.
     """
-    result = make_api_request("POST", "/downlink/start")
+    result = await make_api_request("POST", "/downlink/start")
     if "error" in result:
         return f"Error starting downlink: {result['error']}"
     
@@ -215,45 +296,43 @@ def start_downlink_simple() -> str:
         return f"Failed to start downlink: {result.get('message', 'Unknown error')}"
 
 @mcp.tool()
-def stop_downlink_simple() -> str:
+async def stop_downlink_simple() -> str:
     """
     Stop the current data downlink session (no arguments required).
     Returns complete downlink status including total data downloaded.
     """
-    # Get current status before stopping
-    status_result = make_api_request("GET", "/downlink/status")
+    # Get current status before stopping; stopping may clear start time, bitrate and pass state
+    status_result = await make_api_request("GET", "/downlink/status")
     if "error" in status_result:
         return f"Error getting downlink status: {status_result['error']}"
     
     # Stop the downlink
-    stop_result = make_api_request("POST", "/downlink/stop")
+    stop_result = await make_api_request("POST", "/downlink/stop")
     if "error" in stop_result:
         return f"Error stopping downlink: {stop_result['error']}"
     
+    # Servers that report final status from the stop call override the pre-stop snapshot
+    status_result = {**status_result, **{k: v for k, v in stop_result.items() if v is not None}}
+    
     # Build comprehensive status report
-    status_lines = [
-        f"Downlink stopped: {stop_result.get('message', 'Success')}",
-        "",
-        "Final Downlink Status:",
-        f"- Total Data Downloaded: {status_result.get('kb_downloaded_total', 0):.1f} KB",
-        f"- Final Bitrate: {status_result.get('current_bitrate_kbps', 0)} kbps",
-        f"- Was In Pass: {'Yes' if status_result.get('in_pass') else 'No'}"
-    ]
+    report = _fmt(
+        _DOWNLINK_STOP_TEMPLATE, status_result, _DOWNLINK_STATUS_DEFAULTS,
+        message=stop_result.get('message', 'Success'),
+        was_in_pass='Yes' if status_result.get('in_pass') else 'No',
+    )
     
-    if status_result.get('downlink_start_time_s') is not None:
-        duration = status_result.get('current_sim_time_s', 0) - status_result.get('downlink_start_time_s', 0)
-        status_lines.extend([
-            f"- Downlink Duration: {duration:.1f}s"
-        ])
+    start_time_s = status_result.get('downlink_start_time_s')
+    if start_time_s is not None:
+        report += f"\n- Downlink Duration: {status_result.get('current_sim_time_s', 0) - start_time_s:.1f}s"
     
-    return "\n".join(status_lines)
+    return report
 
 # @mcp.tool()
-# def get_downlink_status() -> str:
+# async def get_downlink_status() -> str:
 #     """
 #     Get current downlink status including whether we're downlinking and total data downloaded.
 #     """
-#     result = make_api_request("GET", "/downlink/status")
+#     result = await make_api_request("GET", "/downlink/status")
 #     if "error" in result:
 #         return f"Error: {result['error']}"
     
@@ -281,10 +360,51 @@ def stop_downlink_simple() -> str:
     
 #     return "\n".join(status_lines)
 
+def _warm_connection_pool() -> None:
+    """Open one connection in the session's pool so the first tool call reuses a live socket.
+
+    Mirrors how HTTPAdapter.send picks its pool (proxies, CA bundle, client cert) but sends a single
+    attempt without the retry policy, so an unreachable API is reported at once instead of stalling startup.
+    """
+    try:
+        request = _SESSION.prepare_request(requests.Request("GET", _BASE_URL + "/time"))
+        settings = _SESSION.merge_environment_settings(request.url, {}, None, None, None)
+        pool = _adapter.get_connection_with_tls_context(
+            request, settings["verify"], proxies=settings["proxies"], cert=settings["cert"]
+        )
+        _adapter.cert_verify(pool, request.url, settings["verify"], settings["cert"])
+        response = pool.urlopen(
+            "GET",
+            _adapter.request_url(request, settings["proxies"]),
+            headers=request.headers,
+            assert_same_host=False,
+            redirect=False,
+            retries=False,
+            timeout=5.0,
+        )
+    except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
+        print(f"Warning: could not reach Trench API at {TRENCH_API_URL}: {e}", file=sys.stderr)
+        return
+    
+    if response.status >= 400:
+        print(f"Warning: Trench API at {TRENCH_API_URL} returned HTTP {response.status}", file=sys.stderr)
+    else:
+        print(f"Connected to Trench API at {TRENCH_API_URL}", file=sys.stderr)
+
 def main():
+    if not TRENCH_API_URL.strip():
+        raise RuntimeError("TRENCH_API_URL must be set to the Trench API base URL")
+    if not TRENCH_API_KEY:
+        print("Warning: TRENCH_API_KEY is not set; API requests will be unauthenticated", file=sys.stderr)
+    
+    _warm_connection_pool()
+    
     transport = os.getenv("MCP_TRANSPORT", "stdio")
-    print(f"Starting Trench MCP Server via transport: {transport}")
-    mcp.run(transport=transport)
+    print(f"Starting Trench MCP Server via transport: {transport}", file=sys.stderr)
+    try:
+        mcp.run(transport=transport)
+    finally:
+        _SESSION.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file